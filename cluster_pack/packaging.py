@@ -1,19 +1,42 @@
+import collections
+import concurrent.futures
+import functools
 import getpass
-import imp
+import importlib.metadata
+import importlib.util
 import json
 import logging
 import os
 import glob
 import pathlib
+import re
 import shutil
+import site
 import subprocess
-from subprocess import CalledProcessError
 import sys
+import sysconfig
 import tempfile
-from typing import Tuple, Dict, Collection, List, Any, Optional, NamedTuple, Union
-import uuid
+from typing import (
+    Tuple,
+    Dict,
+    Collection,
+    Deque,
+    Iterator,
+    List,
+    Any,
+    Optional,
+    NamedTuple,
+    Set,
+    Union,
+)
 import zipfile
-import setuptools
+from urllib import parse, request
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional, only used to speed up json parsing and dumping
+    orjson = None
 
 CRITEO_PYPI_URL = (
     "https://filer-build-pypi.prod.crto.in/repository/criteo.moab.pypi-read/simple"
@@ -21,6 +44,9 @@ CRITEO_PYPI_URL = (
 
 EDITABLE_PACKAGES_INDEX = "editable_packages_index"
 
+# editable packages listed in EDITABLE_PACKAGES_INDEX that could not be found
+_NOT_FOUND_PACKAGES: Set[str] = set()
+
 _logger = logging.getLogger(__name__)
 
 JsonDictType = Dict[str, Any]
@@ -44,16 +70,41 @@ class PythonEnvDescription(NamedTuple):
 UNPACKED_ENV_NAME = "pyenv"
 LARGE_PEX_CMD = f"{UNPACKED_ENV_NAME}/__main__.py"
 
+PEX_STDERR_TAIL_LINES = 2000
+
+COPY_MAX_WORKERS = 8
+
+ZIP_SKIPPED_EXTENSIONS = frozenset({".pyc", ".pyo"})
+
 
 def _get_tmp_dir() -> str:
-    tmp_dir = f"/tmp/{uuid.uuid1()}"
+    tmp_dir = tempfile.mkdtemp(prefix="cluster_pack_")
     _logger.debug(f"local tmp_dir {tmp_dir}")
-    os.makedirs(tmp_dir, exist_ok=True)
     return tmp_dir
 
 
+def _iter_files_to_zip(py_dir: str, arcname_prefix: str) -> Iterator[Tuple[str, str]]:
+    """Yield (path, arcname) of the files of py_dir to add to its archive"""
+    prefix_len = len(os.path.join(py_dir, ""))
+    dirs_to_visit = [py_dir]
+    while dirs_to_visit:
+        with os.scandir(dirs_to_visit.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    # like os.walk, do not follow symlinks to directories
+                    if entry.name != "__pycache__" and not entry.is_symlink():
+                        dirs_to_visit.append(entry.path)
+                # do not include compiled files, it makes the import
+                # fail for no obvious reason
+                elif os.path.splitext(entry.name)[1] not in ZIP_SKIPPED_EXTENSIONS:
+                    yield entry.path, f"{arcname_prefix}{entry.path[prefix_len:]}"
+
+
 def zip_path(
-    py_dir: str, include_base_name: bool = True, tmp_dir: str = _get_tmp_dir()
+    py_dir: str,
+    include_base_name: bool = True,
+    tmp_dir: Optional[str] = None,
+    compression: int = zipfile.ZIP_STORED,
 ) -> str:
     """
     Zip current directory
@@ -62,28 +113,25 @@ def zip_path(
     :param include_base_name: include the basename of py_dir into the archive (
         for skein zip files it should be False,
         for pyspark zip files it should be True)
+    :param tmp_dir: directory where to write the archive, a new temporary
+        directory is created by default
+    :param compression: zipfile compression method, files are stored by default
+        as compressing is slow and the archive is only shipped to the cluster;
+        zipfile.ZIP_DEFLATED uses the fastest compression level
     :return: destination of the archive
     """
-    py_archive = os.path.join(tmp_dir, os.path.basename(py_dir) + ".zip")
-
-    with zipfile.ZipFile(py_archive, "w", zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(py_dir):
-            for file in files:
-                # do not include .pyc files, it makes the import
-                # fail for no obvious reason
-                if not file.endswith(".pyc"):
-                    zipf.write(
-                        os.path.join(root, file),
-                        os.path.join(
-                            os.path.basename(py_dir) if include_base_name else "",
-                            os.path.relpath(root, py_dir),
-                            file,
-                        )
-                        if root != py_dir
-                        else os.path.join(
-                            os.path.basename(root) if include_base_name else "", file
-                        ),
-                    )
+    tmp_dir = tmp_dir or _get_tmp_dir()
+    py_dir = py_dir.rstrip(os.sep) or os.sep
+    base_name = os.path.basename(py_dir)
+    arcname_prefix = f"{base_name}/" if include_base_name else ""
+    py_archive = os.path.join(tmp_dir, base_name + ".zip")
+
+    compresslevel = 1 if compression == zipfile.ZIP_DEFLATED else None
+    with zipfile.ZipFile(
+        py_archive, "w", compression, compresslevel=compresslevel
+    ) as zipf:
+        for path, arcname in _iter_files_to_zip(py_dir, arcname_prefix):
+            zipf.write(path, arcname)
     return py_archive
 
 
@@ -122,6 +170,24 @@ def pack_spec_in_pex(
         )
 
 
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        # hard links can be forbidden (fs.protected_hardlinks, unsupported fs ...)
+        shutil.copy2(src, dst)
+
+
+def _copy_source_dir(source_dir: str, dest_dir: str) -> None:
+    _logger.debug(f"Add {source_dir} as source")
+    same_device = os.stat(source_dir).st_dev == os.stat(dest_dir).st_dev
+    shutil.copytree(
+        source_dir,
+        os.path.join(dest_dir, os.path.basename(source_dir)),
+        copy_function=_link_or_copy if same_device else shutil.copy2,
+    )
+
+
 def pack_in_pex(
     requirements: List[str],
     output: str,
@@ -137,7 +203,9 @@ def pack_in_pex(
 
     :param additional_repo: an additional pypi repo if one was used env creation
     :param requirements: list of requirements (ex {'tensorflow': '1.15.0'})
-    :param output: location of the pex
+    :param output: location of the pex, editable requirements are copied to a
+                   temporary directory next to it (or in the default temporary
+                   directory if its directory is not writable)
     :param ignored_packages: packages to be exluded from pex
     :param pex_inherit_path: see https://github.com/pantsbuild/pex/blob/master/pex/bin/pex.py#L264,
                              possible values ['false', 'fallback', 'prefer']
@@ -147,7 +215,11 @@ def pack_in_pex(
     :return: destination of the archive, name of the pex
     """
 
-    with tempfile.TemporaryDirectory() as tempdir:
+    # sources are copied next to the output so that they can be hard linked
+    # and pex writes on the same filesystem
+    output_dir = os.path.dirname(os.path.abspath(output))
+    writable = os.access(output_dir, os.W_OK | os.X_OK)
+    with tempfile.TemporaryDirectory(dir=output_dir if writable else None) as tempdir:
         cmd = ["pex", f"--inherit-path={pex_inherit_path}"]
 
         if allow_large_pex:
@@ -159,12 +231,15 @@ def pack_in_pex(
             cmd.extend(["--include-tools"])
 
         if editable_requirements and len(editable_requirements) > 0:
-            for current_package in editable_requirements.values():
-                _logger.debug("Add current path as source", current_package)
-                shutil.copytree(
-                    current_package,
-                    os.path.join(tempdir, os.path.basename(current_package)),
-                )
+            with concurrent.futures.ThreadPoolExecutor(
+                min(COPY_MAX_WORKERS, len(editable_requirements))
+            ) as executor:
+                futures = [
+                    executor.submit(_copy_source_dir, current_package, tempdir)
+                    for current_package in editable_requirements.values()
+                ]
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
             cmd.append(f"--sources-directory={tempdir}")
 
         for req in requirements:
@@ -192,15 +267,23 @@ def pack_in_pex(
 
         cmd.extend(["-o", output + tmp_ext])
 
-        try:
-            print(f"Running command: {' '.join(cmd)}")
-            call = subprocess.run(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-            call.check_returncode()
-
-        except CalledProcessError as err:
-            _logger.exception("Cannot create pex")
-            _logger.exception(err.stderr.decode("ascii"))
-            raise PexCreationError(err.stderr.decode("ascii"))
+        print(f"Running command: {' '.join(cmd)}")
+        # only keep the tail of pex output: verbose resolves can log a lot
+        stderr_tail: Deque[str] = collections.deque(maxlen=PEX_STDERR_TAIL_LINES)
+        with subprocess.Popen(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors="replace",
+        ) as proc:
+            # stderr is the only pipe, draining it here cannot deadlock
+            stderr_tail.extend(proc.stderr)
+        if proc.returncode != 0:
+            stderr = "".join(stderr_tail)
+            _logger.error("Cannot create pex")
+            _logger.error(stderr)
+            raise PexCreationError(stderr)
 
         if (
             not allow_large_pex
@@ -218,41 +301,203 @@ def pack_in_pex(
     return output + ".zip" if allow_large_pex else output
 
 
+def _loads_json(data: Union[bytes, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _dumps_json(obj: Any) -> bytes:
+    """Compact utf-8 json, the same with or without orjson"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
 def _get_packages(
     editable: bool, executable: str = sys.executable
 ) -> List[JsonDictType]:
+    # listing packages is slow, results are cached until a package is installed
+    # or removed for the executable (see _list_packages.cache_clear())
+    return _list_packages(editable, executable, _get_install_state(executable))
+
+
+def _is_current_interpreter(executable: str) -> bool:
+    return os.path.abspath(executable) == os.path.abspath(sys.executable)
+
+
+def _get_install_state(executable: str) -> Tuple[Tuple[str, Optional[int]], ...]:
+    """
+    Modification times of the executable and of its site-packages directories,
+    installing or removing a package modifies at least one of them
+    """
+    if _is_current_interpreter(executable):
+        site_dirs = _get_pythonpath() + _get_site_dirs()
+    else:
+        prefix = os.path.dirname(os.path.dirname(os.path.abspath(executable)))
+        site_dirs = glob.glob(os.path.join(prefix, "lib*", "python*", "site-packages"))
+
+    state = []
+    for path in [executable] + site_dirs:
+        try:
+            state.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            state.append((path, None))
+    return tuple(state)
+
+
+@functools.lru_cache(maxsize=16)
+def _list_packages(
+    editable: bool, executable: str, install_state: Tuple[Tuple[str, Optional[int]], ...]
+) -> List[JsonDictType]:
+    # install_state is only part of the cache key
+    if _is_current_interpreter(executable):
+        return _list_installed_packages(editable)
+
     editable_mode = "-e" if editable else "--exclude-editable"
     # We only keep the first line because pip warnings on subsequent lines can cause
     # JSONDecodeError below
-    results = (
-        subprocess.check_output(
-            [
-                f"{executable}",
-                "-m",
-                "pip",
-                "list",
-                "-l",
-                f"{editable_mode}",
-                "--format",
-                "json",
-                "-v",
-            ]
-        )
-        .decode()
-        .split("\n")[0]
-    )
+    results, _, _ = subprocess.check_output(
+        [
+            f"{executable}",
+            "-m",
+            "pip",
+            "list",
+            "-l",
+            f"{editable_mode}",
+            "--format",
+            "json",
+            "-v",
+        ]
+    ).partition(b"\n")
 
-    _logger.debug(f"'pip list' with editable={editable} results:" + results)
+    _logger.debug(
+        f"'pip list' with editable={editable} results:" + results.decode()
+    )
 
     try:
-        return json.loads(results)
+        return _loads_json(results)
     except json.JSONDecodeError as e:
         _logger.error(
-            f"Caught below exception while parsing output of pip list: {results}"
+            f"Caught below exception while parsing output of pip list: {results.decode()}"
         )
         raise e
 
 
+def _list_installed_packages(editable: bool) -> List[JsonDictType]:
+    """
+    Same as 'pip list -l [-e|--exclude-editable] --format json -v' for the
+    current interpreter, without starting a new one
+
+    Packages have the name, version, location and installer keys, and
+    editable_project_location for editable installs (PEP 660 or legacy
+    egg-link installs). Packages are sorted by canonical name.
+    """
+    running_in_venv = sys.prefix != sys.base_prefix
+    prefix = os.path.join(os.path.normcase(os.path.realpath(sys.prefix)), "")
+
+    packages: List[Tuple[str, JsonDictType]] = []
+    seen: Set[str] = set()
+    for dist in importlib.metadata.distributions(path=_get_default_sys_path()):
+        name = dist.metadata["Name"]
+        canonical_name = _canonicalize_name(name) if name else ""
+        if not canonical_name or canonical_name in seen:
+            continue
+        seen.add(canonical_name)
+        location = str(dist.locate_file(""))
+        egg_link = _find_egg_link(name)
+        # legacy editable installs are local if their egg-link is
+        installed_location = os.path.dirname(egg_link) if egg_link else location
+        if running_in_venv and not os.path.join(
+            os.path.normcase(os.path.realpath(installed_location)), ""
+        ).startswith(prefix):
+            continue
+        package = {
+            "name": name,
+            "version": dist.version,
+            "location": location,
+            "installer": _get_installer(dist),
+        }
+        editable_project_location = _get_editable_project_location(dist) or (
+            location if egg_link else None
+        )
+        if editable_project_location:
+            package["editable_project_location"] = editable_project_location
+        if bool(editable_project_location) == editable:
+            packages.append((canonical_name, package))
+    return [package for _, package in sorted(packages, key=lambda item: item[0])]
+
+
+def _get_default_sys_path() -> List[str]:
+    """
+    sys.path of a new interpreter, as seen by pip (without the current directory)
+
+    sys.path of the current interpreter can not be used, it is modified at runtime
+    (vendored packages of pex, editable finders, user code ...)
+    """
+    paths = _get_pythonpath()
+    for site_dir in _get_site_dirs():
+        if not os.path.isdir(site_dir):
+            continue
+        paths.append(site_dir)
+        # directories added by .pth files, like 'setup.py develop' installs
+        for pth_file in sorted(glob.glob(os.path.join(site_dir, "*.pth"))):
+            with open(pth_file) as f:
+                for line in f:
+                    line = line.rstrip()
+                    if not line or line.startswith(("#", "import ", "import\t")):
+                        continue
+                    path = os.path.join(site_dir, line)
+                    if os.path.exists(path):
+                        paths.append(path)
+    return list(dict.fromkeys(paths))
+
+
+def _get_pythonpath() -> List[str]:
+    return [path for path in os.environ.get("PYTHONPATH", "").split(os.pathsep) if path]
+
+
+def _get_site_dirs() -> List[str]:
+    site_dirs = site.getsitepackages()
+    if site.ENABLE_USER_SITE:
+        site_dirs = [site.getusersitepackages()] + site_dirs
+    return site_dirs
+
+
+def _canonicalize_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _get_editable_project_location(
+    dist: importlib.metadata.Distribution,
+) -> Optional[str]:
+    direct_url = dist.read_text("direct_url.json")
+    if direct_url:
+        url_info = _loads_json(direct_url)
+        if url_info.get("dir_info", {}).get("editable"):
+            return request.url2pathname(parse.urlparse(url_info["url"]).path)
+    return None
+
+
+def _get_installer(dist: importlib.metadata.Distribution) -> str:
+    installer = dist.read_text("INSTALLER") or ""
+    return next((line.strip() for line in installer.splitlines() if line.strip()), "")
+
+
+def _find_egg_link(name: str) -> Optional[str]:
+    # legacy 'setup.py develop' installs are referenced by an egg-link,
+    # in the user site too when it is enabled ('setup.py develop --user')
+    site_dirs = [sysconfig.get_path("purelib"), sysconfig.get_path("platlib")]
+    if site.ENABLE_USER_SITE:
+        site_dirs.append(site.getusersitepackages())
+    for site_dir in dict.fromkeys(site_dirs):
+        for egg_link_name in {name, re.sub(r"[^A-Za-z0-9.]+", "-", name)}:
+            egg_link = os.path.join(site_dir, f"{egg_link_name}.egg-link")
+            if os.path.isfile(egg_link):
+                return egg_link
+    return None
+
+
 class Packer(object):
     def env_name(self) -> str:
         raise NotImplementedError
@@ -347,19 +592,29 @@ def _get_editable_requirements(executable: str = sys.executable) -> List[str]:
     top_level_pkgs = []
     for pkg in _get_packages(True, executable):
         location = pkg.get("editable_project_location", pkg.get("location", ""))
-        packages_found = set(
-            setuptools.find_packages(location)
-            + setuptools.find_packages(f"{location}/src")
-        )
-        for _pkg in packages_found:
-            if "." in _pkg:
-                continue
-            imported = __import__(_pkg)
-            if imported.__file__:
-                top_level_pkgs.append(os.path.dirname(imported.__file__))
+        # packages are located on disk rather than imported to get their
+        # __file__, importing user code can be slow and have side effects
+        for packages_dir in (location, os.path.join(location, "src")):
+            top_level_pkgs.extend(_find_top_level_packages(packages_dir))
     return top_level_pkgs
 
 
+def _find_top_level_packages(packages_dir: str) -> List[str]:
+    # same as the top-level packages of setuptools.find_packages but without
+    # walking the subpackages
+    try:
+        with os.scandir(packages_dir) as entries:
+            return [
+                entry.path
+                for entry in entries
+                if "." not in entry.name
+                and entry.is_dir()
+                and os.path.isfile(os.path.join(entry.path, "__init__.py"))
+            ]
+    except FileNotFoundError:
+        return []
+
+
 def get_non_editable_requirements(executable: str = sys.executable) -> Dict[str, str]:
     return {
         package["name"]: package["version"]
@@ -467,6 +722,21 @@ def get_current_pex_filepath() -> str:
         )
 
 
+def _find_package_path(package_name: str) -> Optional[str]:
+    if package_name in _NOT_FOUND_PACKAGES:
+        return None
+    try:
+        spec = importlib.util.find_spec(package_name)
+    except (ImportError, ValueError):
+        spec = None
+    if spec is None:
+        _NOT_FOUND_PACKAGES.add(package_name)
+        return None
+    if spec.submodule_search_locations:
+        return next(iter(spec.submodule_search_locations))
+    return spec.origin
+
+
 def get_editable_requirements(
     executable: str = sys.executable,
     editable_packages_dir: str = os.getcwd(),  # only overridden for tests
@@ -483,10 +753,10 @@ def get_editable_requirements(
             editable_requirements = {}
         else:
             for package_name in package_names:
-                try:
-                    _, path, _ = imp.find_module(package_name)
+                path = _find_package_path(package_name)
+                if path:
                     editable_requirements[os.path.basename(path)] = path
-                except ImportError:
+                else:
                     _logger.error(
                         f"Could not import package {package_name}"
                         f" repo exists={os.path.exists(package_name)}"
@@ -518,7 +788,15 @@ def get_pyenv_usage_from_archive(path_to_archive: str) -> PythonEnvDescription:
         )
 
 
+@functools.lru_cache(maxsize=1)
 def get_default_fs() -> str:
+    """
+    Return fs.defaultFS, it can be set in HADOOP_FS_DEFAULTFS to avoid starting
+    'hdfs getconf' (the result is cached, see get_default_fs.cache_clear())
+    """
+    default_fs = os.environ.get("HADOOP_FS_DEFAULTFS")
+    if default_fs:
+        return default_fs
     return (
         subprocess.check_output("hdfs getconf -confKey fs.defaultFS".split())
         .strip()
@@ -526,6 +804,7 @@ def get_default_fs() -> str:
     )
 
 
+@functools.lru_cache(maxsize=1)
 def _running_from_pex() -> bool:
     # Env variable PEX has been introduced in pex==2.1.54 and is now the
     # preferred way to detect whether we run from within a pex
@@ -541,5 +820,6 @@ def _running_from_pex() -> bool:
         return False
 
 
+@functools.lru_cache(maxsize=1)
 def _is_criteo() -> bool:
     return "CRITEO_ENV" in os.environ
@@ -18,7 +18,7 @@ def build_with_func(
     args: List[Any] = [],
     package_path: Optional[str] = None,
     additional_files: Optional[List[str]] = None,
-    tmp_dir: str = packaging._get_tmp_dir(),
+    tmp_dir: Optional[str] = None,
     log_level: str = "INFO",
     process_logs: Callable[[str], Any] = None,
     allow_large_pex: bool = False,
@@ -40,6 +40,7 @@ def build_with_func(
                             and the entry point will be <output>/__main__.py
     :return: SkeinConfig
     """
+    tmp_dir = tmp_dir or packaging._get_tmp_dir()
     function_name = f"function_{uuid.uuid4()}.dat"
     function_path = f"{tmp_dir}/{function_name}"
     val_to_serialize = {"func": func, "args": args}
@@ -67,7 +68,7 @@ def build(
     args: List[Any] = [],
     package_path: Optional[str] = None,
     additional_files: Optional[List[str]] = None,
-    tmp_dir: str = packaging._get_tmp_dir(),
+    tmp_dir: Optional[str] = None,
     process_logs: Callable[[str], Any] = None,
     allow_large_pex: bool = False,
 ) -> SkeinConfig:
@@ -85,6 +86,7 @@ def build(
                             and the entry point will be <output>/__main__.py
     :return: SkeinConfig
     """
+    tmp_dir = tmp_dir or packaging._get_tmp_dir()
     if not package_path:
         package_path, _ = uploader.upload_env(allow_large_pex=allow_large_pex)
 
@@ -145,8 +147,9 @@ def _get_script(
 def _get_files(
     python_env_descriptor: packaging.PythonEnvDescription,
     additional_files: Optional[List[str]] = None,
-    tmp_dir: str = packaging._get_tmp_dir(),
+    tmp_dir: Optional[str] = None,
 ) -> Dict[str, str]:
+    tmp_dir = tmp_dir or packaging._get_tmp_dir()
     dict_files_to_upload = {
         python_env_descriptor.dest_path: python_env_descriptor.path_to_archive
     }
@@ -157,7 +160,7 @@ def _get_files(
     editable_requirements = packaging.get_editable_requirements()
 
     editable_packages = {
-        name: packaging.zip_path(path, False)
+        name: packaging.zip_path(path, False, tmp_dir)
         for name, path in editable_requirements.items()
     }
     dict_files_to_upload.update(editable_packages)
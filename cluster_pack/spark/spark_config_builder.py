@@ -1,5 +1,8 @@
+import atexit
+import functools
 import os
 import logging
+import shutil
 from pyspark.sql import SparkSession
 
 from cluster_pack import packaging, get_pyenv_usage_from_archive
@@ -31,12 +34,29 @@ def add_packaged_environment(ssb: SparkSession.Builder, archive: str) -> None:
         _add_or_merge(ssb, "spark.files", f"{archive}")
 
 
-def add_editable_requirements(ssb: SparkSession.Builder) -> None:
+def add_editable_requirements(
+    ssb: SparkSession.Builder, tmp_dir: Optional[str] = None
+) -> None:
+    """
+    Add the editable packages of the current env as archives
+
+    :param tmp_dir: directory where to zip the editable packages, the archives
+        must be kept until the spark session is created; by default a temporary
+        directory removed at exit is used
+    """
+    tmp_dir = tmp_dir or _get_editable_archives_dir()
     for requirement_dir in packaging.get_editable_requirements().values():
-        py_archive = packaging.zip_path(requirement_dir)
+        py_archive = packaging.zip_path(requirement_dir, True, tmp_dir)
         _add_archive(ssb, py_archive)
 
 
+@functools.lru_cache(maxsize=1)
+def _get_editable_archives_dir() -> str:
+    tmp_dir = packaging._get_tmp_dir()
+    atexit.register(shutil.rmtree, tmp_dir, ignore_errors=True)
+    return tmp_dir
+
+
 def add_s3_params(ssb: SparkSession.Builder, fs_args: Dict[str, Any] = {}) -> None:
     ssb.config("spark.hadoop.fs.s3a.impl", "org.apache.hadoop.fs.s3a.S3AFileSystem")
     ssb.config("spark.hadoop.fs.s3a.path.style.access", "true")
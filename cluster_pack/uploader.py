@@ -1,14 +1,14 @@
 import getpass
 import hashlib
-import json
 import logging
 import os
 import sys
 import pathlib
 import platform
+import shutil
 import tempfile
 from typing import Tuple, Dict, Collection, List, Any, Optional, Union
-from urllib import parse, request
+from urllib import error, parse, request
 
 from pex.pex_info import PexInfo
 from wheel_filename import parse_wheel_filename
@@ -21,36 +21,72 @@ PACKAGE_INSTALLED_KEY = "package_installed"
 PLATFORM_KEY = "platform"
 PYTHON_VERSION_KEY = "python_version"
 
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# metadata path -> (modification time, size, sorted packages, archive is up to date),
+# only the last check of each metadata is kept
+_ARCHIVE_UP_TO_DATE_CACHE: Dict[str, Tuple[Any, Any, Tuple[str, ...], bool]] = {}
+
 
 def _get_archive_metadata_path(package_path: str) -> str:
     url = parse.urlparse(package_path)
     return url._replace(path=str(pathlib.Path(url.path).with_suffix(".json"))).geturl()
 
 
+def _prefetch_dir(resolved_fs: Any, dirname: str) -> Dict[str, Dict[str, Any]]:
+    """List dirname once, returns the info of its entries by basename"""
+    try:
+        entries = resolved_fs.ls(dirname, detail=True)
+    except FileNotFoundError:
+        return {}
+    return {os.path.basename(entry["name"].rstrip("/")): entry for entry in entries}
+
+
 def _is_archive_up_to_date(
     package_path: str, current_packages_list: List[str], resolved_fs: Any = None
 ) -> bool:
-    if not resolved_fs.exists(package_path):
+    dir_content = _prefetch_dir(resolved_fs, os.path.dirname(package_path))
+    if os.path.basename(package_path) not in dir_content:
         return False
     archive_meta_data = _get_archive_metadata_path(package_path)
-    if not resolved_fs.exists(archive_meta_data):
+    info = dir_content.get(os.path.basename(archive_meta_data))
+    if info is None:
         _logger.debug(f"metadata for archive {package_path} does not exist")
         return False
+
+    # the metadata is only read again if it has been modified since the last check
+    modification_time = info.get("mtime", info.get("LastModified"))
+    cache_key = (modification_time, info.get("size"), tuple(sorted(current_packages_list)))
+    cached = _ARCHIVE_UP_TO_DATE_CACHE.get(archive_meta_data)
+    if modification_time is not None and cached is not None and cached[:3] == cache_key:
+        return cached[3]
+
     with resolved_fs.open(archive_meta_data, "rb") as fd:
-        metadata_dict = json.loads(fd.read())
-        if not isinstance(metadata_dict, dict):
-            _logger.debug("metadata exists but was built with old format")
-            return False
-
-        current_platform, current_python_version = get_platform_and_python_version()
-        packages_installed = metadata_dict.get(PACKAGE_INSTALLED_KEY, [])
-        platform = metadata_dict.get(PLATFORM_KEY, "")
-        python_version = metadata_dict.get(PYTHON_VERSION_KEY, "")
-        return (
-            sorted(packages_installed) == sorted(current_packages_list)
-            and platform == current_platform
-            and python_version == current_python_version
-        )
+        up_to_date = _is_metadata_up_to_date(fd.read(), current_packages_list)
+    if modification_time is not None:
+        _ARCHIVE_UP_TO_DATE_CACHE[archive_meta_data] = cache_key + (up_to_date,)
+    return up_to_date
+
+
+def _is_metadata_up_to_date(metadata: bytes, current_packages_list: List[str]) -> bool:
+    # metadata dumped for the same packages in the same order is byte identical
+    if metadata == packaging._dumps_json(build_metadata_dict(current_packages_list)):
+        return True
+
+    metadata_dict = packaging._loads_json(metadata)
+    if not isinstance(metadata_dict, dict):
+        _logger.debug("metadata exists but was built with old format")
+        return False
+
+    current_platform, current_python_version = get_platform_and_python_version()
+    packages_installed = metadata_dict.get(PACKAGE_INSTALLED_KEY, [])
+    platform = metadata_dict.get(PLATFORM_KEY, "")
+    python_version = metadata_dict.get(PYTHON_VERSION_KEY, "")
+    return (
+        sorted(packages_installed) == sorted(current_packages_list)
+        and platform == current_platform
+        and python_version == current_python_version
+    )
 
 
 def _dump_archive_metadata(
@@ -60,10 +96,14 @@ def _dump_archive_metadata(
     metadata_dict = build_metadata_dict(current_packages_list)
     with tempfile.TemporaryDirectory() as tempdir:
         tempfile_path = os.path.join(tempdir, "metadata.json")
-        with open(tempfile_path, "w") as fd:
-            fd.write(json.dumps(metadata_dict, indent=4))
+        with open(tempfile_path, "wb") as fd:
+            fd.write(packaging._dumps_json(metadata_dict))
         if resolved_fs.exists(archive_meta_data):
-            resolved_fs.rm(archive_meta_data)
+            try:
+                resolved_fs.rm(archive_meta_data)
+            except FileNotFoundError:
+                # removed concurrently since the check
+                pass
         resolved_fs.put(tempfile_path, archive_meta_data)
 
 
@@ -85,6 +125,19 @@ def get_platform_and_python_version() -> Tuple[str, str]:
     return platform.platform(), python_version_str
 
 
+def _download(url: str, local_path: str) -> None:
+    with request.urlopen(url) as response, open(local_path, "wb") as fd:
+        shutil.copyfileobj(response, fd, DOWNLOAD_CHUNK_SIZE)
+        size = int(response.headers.get("Content-Length", -1))
+        read = fd.tell()
+    # like urlretrieve, fail if the connection was closed before the end
+    if read < size:
+        raise error.ContentTooShortError(
+            f"retrieval incomplete: got only {read} out of {size} bytes",
+            (local_path, response.headers),
+        )
+
+
 def upload_zip(
     zip_file: str,
     package_path: str = None,
@@ -100,7 +153,7 @@ def upload_zip(
         parsed_url = parse.urlparse(zip_file)
         if parsed_url.scheme == "http":
             tmp_zip_file = os.path.join(tempdir, os.path.basename(parsed_url.path))
-            request.urlretrieve(zip_file, tmp_zip_file)
+            _download(zip_file, tmp_zip_file)
             zip_file = tmp_zip_file
 
         _upload_pex_file(packer, zip_file, package_path, resolved_fs, force_upload)
@@ -421,7 +474,7 @@ def _pack_from_venv(
             f"Copying pre-built env from {fallback_path} to {local_package_path}"
         )
         if fallback_path.startswith("http://") or fallback_path.startswith("https://"):
-            request.urlretrieve(fallback_path, local_package_path)
+            _download(fallback_path, local_package_path)
         else:
             fallback_fs, fallback_path = filesystem.resolve_filesystem_and_path(
                 fallback_path
@@ -3,6 +3,7 @@ import sys
 import pytest
 from pyspark.sql import SparkSession
 import tempfile
+from unittest import mock
 
 from cluster_pack.spark import spark_config_builder
 
@@ -58,3 +59,26 @@ def test_add_packaged_environment(local_spark_session_builder):
         assert ss.sparkContext.getConf().get("spark.files") == f"{tempdir}/myenv.pex"
 
         ss.stop()
+
+
+def test_add_editable_requirements(local_spark_session_builder):
+    with tempfile.TemporaryDirectory() as tempdir:
+        pkg = os.path.join(tempdir, "pkg")
+        os.makedirs(pkg)
+        with open(os.path.join(pkg, "__init__.py"), "w"):
+            pass
+        archives_dir = os.path.join(tempdir, "archives")
+        os.makedirs(archives_dir)
+
+        with mock.patch(
+            "cluster_pack.packaging.get_editable_requirements",
+            return_value={"pkg": pkg},
+        ):
+            spark_config_builder.add_editable_requirements(
+                local_spark_session_builder, archives_dir
+            )
+
+        assert os.listdir(archives_dir) == ["pkg.zip"]
+        assert spark_config_builder._get_value(
+            local_spark_session_builder, "spark.yarn.dist.archives"
+        ) == os.path.join(archives_dir, "pkg.zip")
@@ -1,4 +1,5 @@
 import contextlib
+import json
 import os
 import stat
 import subprocess
@@ -90,6 +91,9 @@ def test__get_editable_requirements():
         pkg_names = [os.path.basename(req) for req in editable_requirements]
         assert "user_lib" in pkg_names
         assert "user_lib2" in pkg_names
+        assert {os.path.dirname(req) for req in editable_requirements} == {
+            _get_editable_package_name()
+        }
 
 
 def test__get_editable_requirements_for_src_layout():
@@ -103,6 +107,9 @@ def test__get_editable_requirements_for_src_layout():
         pkg_names = [os.path.basename(req) for req in editable_requirements]
         assert "user_lib" in pkg_names
         assert "user_lib2" in pkg_names
+        assert {os.path.dirname(req) for req in editable_requirements} == {
+            os.path.join(_get_editable_package_name_src_layout(), "src")
+        }
 
 
 def test__get_editable_requirements_withpip23():
@@ -118,6 +125,18 @@ def test__get_editable_requirements_withpip23():
         assert "user_lib2" in pkg_names
 
 
+def test_find_top_level_packages(tmpdir):
+    pkg = tmpdir.mkdir("pkg")
+    pkg.join("__init__.py").write_text("", encoding="utf-8")
+    pkg.mkdir("subpkg").join("__init__.py").write_text("", encoding="utf-8")
+    tmpdir.mkdir("not_a_pkg").join("module.py").write_text("", encoding="utf-8")
+    tmpdir.mkdir("pkg.egg-info").join("__init__.py").write_text("", encoding="utf-8")
+    tmpdir.join("module.py").write_text("", encoding="utf-8")
+
+    assert packaging._find_top_level_packages(str(tmpdir)) == [str(pkg)]
+    assert packaging._find_top_level_packages(str(tmpdir.join("src"))) == []
+
+
 def test_get_non_editable_requirements():
     with tempfile.TemporaryDirectory() as tempdir:
         _create_venv(tempdir)
@@ -188,6 +207,18 @@ def test_get_current_pex_filepath():
         )
 
 
+def test_running_from_pex_is_cached():
+    packaging._running_from_pex.cache_clear()
+    try:
+        with mock.patch.dict("os.environ"):
+            os.environ["PEX"] = "/path/to/app.pex"
+            assert packaging._running_from_pex()
+            del os.environ["PEX"]
+            assert packaging._running_from_pex()
+    finally:
+        packaging._running_from_pex.cache_clear()
+
+
 def test_get_editable_requirements():
     with mock.patch(f"{MODULE_TO_TEST}._running_from_pex") as mock_running_from_pex:
         mock_running_from_pex.return_value = True
@@ -202,6 +233,15 @@ def test_get_editable_requirements():
             assert editable_requirements == {os.path.basename(pkg): pkg}
 
 
+def test_find_package_path_caches_missing_packages():
+    with mock.patch(
+        f"{MODULE_TO_TEST}.importlib.util.find_spec", return_value=None
+    ) as mock_find_spec, mock.patch.object(packaging, "_NOT_FOUND_PACKAGES", set()):
+        assert packaging._find_package_path("not_existing_pkg") is None
+        assert packaging._find_package_path("not_existing_pkg") is None
+        mock_find_spec.assert_called_once_with("not_existing_pkg")
+
+
 def test_zip_path(tmpdir):
     s = "Hello, world!"
     tmpdir.mkdir("foo").join("bar.txt").write_text(s, encoding="utf-8")
@@ -223,6 +263,66 @@ def test_zip_path(tmpdir):
             assert zf.read("foo/bar.txt") == s.encode()
             assert zf.read("py-lib/bar.py") == s.encode()
             assert zf.read("boo.bin") == b
+            assert {zi.compress_type for zi in zf.filelist} == {zipfile.ZIP_STORED}
+
+
+def test_zip_path_with_trailing_separator(tmpdir):
+    pkg = tmpdir.mkdir("pkg")
+    pkg.mkdir("sub").join("mod.py").write_text("", encoding="utf-8")
+
+    with tempfile.TemporaryDirectory() as tempdirpath:
+        zipped_path = packaging.zip_path(f"{pkg}{os.sep}", True, tempdirpath)
+        assert zipped_path == os.path.join(tempdirpath, "pkg.zip")
+        with zipfile.ZipFile(zipped_path) as zf:
+            assert zf.namelist() == ["pkg/sub/mod.py"]
+
+
+def test_zip_path_uses_a_new_tmp_dir_by_default(tmpdir):
+    tmpdir.join("bar.txt").write_text("Hello, world!", encoding="utf-8")
+
+    first_zip = packaging.zip_path(str(tmpdir))
+    second_zip = packaging.zip_path(str(tmpdir))
+    try:
+        assert os.path.dirname(first_zip) != os.path.dirname(second_zip)
+        assert zipfile.is_zipfile(first_zip)
+        assert zipfile.is_zipfile(second_zip)
+    finally:
+        shutil.rmtree(os.path.dirname(first_zip))
+        shutil.rmtree(os.path.dirname(second_zip))
+
+
+def test_zip_path_skips_compiled_files(tmpdir):
+    pkg = tmpdir.mkdir("pkg")
+    pkg.join("__init__.py").write_text("", encoding="utf-8")
+    pkg.join("mod.pyc").write_binary(b"")
+    pkg.join("mod.pyo").write_binary(b"")
+    pkg.join("pyc.txt").write_text("", encoding="utf-8")
+    sub = pkg.mkdir("sub")
+    sub.join("mod.py").write_text("", encoding="utf-8")
+    sub.mkdir("__pycache__").join("mod.cpython-39.pyc").write_binary(b"")
+
+    with tempfile.TemporaryDirectory() as tempdirpath:
+        zipped_path = packaging.zip_path(str(pkg), True, tempdirpath)
+        with zipfile.ZipFile(zipped_path) as zf:
+            assert {zi.filename for zi in zf.filelist} == {
+                "pkg/__init__.py",
+                "pkg/pyc.txt",
+                "pkg/sub/mod.py",
+            }
+
+
+def test_zip_path_with_compression(tmpdir):
+    s = b"Hello, world!" * 100
+    tmpdir.join("bar.txt").write_binary(s)
+
+    with tempfile.TemporaryDirectory() as tempdirpath:
+        zipped_path = packaging.zip_path(
+            str(tmpdir), False, tempdirpath, zipfile.ZIP_DEFLATED
+        )
+        with zipfile.ZipFile(zipped_path) as zf:
+            assert zf.testzip() is None
+            assert zf.read("bar.txt") == s
+            assert {zi.compress_type for zi in zf.filelist} == {zipfile.ZIP_DEFLATED}
 
 
 def _create_editable_files(tempdir, pkg):
@@ -275,6 +375,58 @@ def test_pack_in_pex(pyarrow_version, expectation):
             )
 
 
+def test_pack_in_pex_raises_with_stderr_tail():
+    popen = subprocess.Popen
+    failing_cmd = [
+        sys.executable,
+        "-c",
+        "import sys; sys.stderr.write('first\\nsecond\\nlast\\n'); sys.exit(1)",
+    ]
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch(f"{MODULE_TO_TEST}.PEX_STDERR_TAIL_LINES", 2))
+        stack.enter_context(
+            mock.patch(
+                f"{MODULE_TO_TEST}.subprocess.Popen",
+                side_effect=lambda cmd, **kwargs: popen(failing_cmd, **kwargs),
+            )
+        )
+        tempdir = stack.enter_context(tempfile.TemporaryDirectory())
+        with pytest.raises(packaging.PexCreationError) as exc_info:
+            packaging.pack_in_pex(["cloudpickle"], f"{tempdir}/out.pex")
+        assert str(exc_info.value) == "second\nlast\n"
+
+
+@pytest.mark.parametrize("output_dir_exists", [True, False])
+def test_pack_in_pex_copies_sources_next_to_output(tmpdir, output_dir_exists):
+    popen = subprocess.Popen
+    output_dir = tmpdir.join("out")
+    if output_dir_exists:
+        output_dir.mkdir()
+    output = str(output_dir.join("out.pex"))
+    sources_dirs = []
+
+    def _fake_pex(cmd, **kwargs):
+        sources_dirs.extend(
+            arg.split("=", 1)[1]
+            for arg in cmd
+            if arg.startswith("--sources-directory=")
+        )
+        output_dir.ensure("out.pex")
+        return popen([sys.executable, "-c", ""], **kwargs)
+
+    requirement_dir = os.path.join(os.path.dirname(__file__), "user-lib", "user_lib")
+    with mock.patch(f"{MODULE_TO_TEST}.subprocess.Popen", side_effect=_fake_pex):
+        packaging.pack_in_pex(
+            [], output, editable_requirements={"user_lib": requirement_dir}
+        )
+
+    assert len(sources_dirs) == 1
+    assert os.path.dirname(sources_dirs[0]) == (
+        str(output_dir) if output_dir_exists else tempfile.gettempdir()
+    )
+    assert not os.path.exists(sources_dirs[0])
+
+
 def test_pack_in_pex_with_allow_large():
     with tempfile.TemporaryDirectory() as tempdir:
         requirements = [
@@ -461,6 +613,27 @@ def test_pack_in_pex_include_editable_requirements():
             )
 
 
+def test_copy_source_dir_hard_links_on_same_device(tmpdir):
+    tmpdir.mkdir("src").mkdir("user_lib").join("__init__.py").write_text(
+        "", encoding="utf-8"
+    )
+    source_dir = str(tmpdir.join("src", "user_lib"))
+
+    linked_dir = str(tmpdir.mkdir("linked"))
+    packaging._copy_source_dir(source_dir, linked_dir)
+    assert os.path.samefile(
+        f"{source_dir}/__init__.py", f"{linked_dir}/user_lib/__init__.py"
+    )
+
+    copied_dir = str(tmpdir.mkdir("copied"))
+    with mock.patch(f"{MODULE_TO_TEST}.os.link", side_effect=PermissionError):
+        packaging._copy_source_dir(source_dir, copied_dir)
+    assert os.path.isfile(f"{copied_dir}/user_lib/__init__.py")
+    assert not os.path.samefile(
+        f"{source_dir}/__init__.py", f"{copied_dir}/user_lib/__init__.py"
+    )
+
+
 def test_pack_in_pex_from_spec():
     with tempfile.TemporaryDirectory() as tempdir:
         spec_file = os.path.join(
@@ -488,22 +661,125 @@ def test_pack_in_pex_from_spec():
             )
 
 
-def test_get_packages():
-    subprocess.check_output = mock.Mock(return_value='{"key": "value"}'.encode())
-    packages = packaging._get_packages(False)
+@pytest.fixture
+def clear_packages_cache():
+    packaging._list_packages.cache_clear()
+    yield
+    packaging._list_packages.cache_clear()
+
+
+def test_get_packages(clear_packages_cache):
+    with mock.patch(f"{MODULE_TO_TEST}.subprocess.check_output") as mock_check_output:
+        mock_check_output.return_value = '{"key": "value"}'.encode()
+        packages = packaging._get_packages(False, "/path/to/python")
     expected_packages = {"key": "value"}
     assert packages == expected_packages
 
 
-def test_get_packages_with_warning():
-    subprocess.check_output = mock.Mock(
-        return_value='{"key": "value"}\nwarning'.encode()
-    )
-    packages = packaging._get_packages(False)
+def test_get_packages_with_warning(clear_packages_cache):
+    with mock.patch(f"{MODULE_TO_TEST}.subprocess.check_output") as mock_check_output:
+        mock_check_output.return_value = '{"key": "value"}\nwarning'.encode()
+        packages = packaging._get_packages(False, "/path/to/python")
     expected_packages = {"key": "value"}
     assert packages == expected_packages
 
 
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_get_packages_parse_error(clear_packages_cache, use_orjson):
+    with contextlib.ExitStack() as stack:
+        if not use_orjson:
+            stack.enter_context(mock.patch(f"{MODULE_TO_TEST}.orjson", None))
+        mock_check_output = stack.enter_context(
+            mock.patch(f"{MODULE_TO_TEST}.subprocess.check_output")
+        )
+        mock_check_output.return_value = b"warning\n[]"
+        with pytest.raises(json.JSONDecodeError):
+            packaging._get_packages(False, "/path/to/python")
+
+
+@pytest.mark.parametrize("editable", [True, False])
+def test_get_packages_of_current_interpreter(clear_packages_cache, editable):
+    editable_mode = "-e" if editable else "--exclude-editable"
+    pip_list_output = subprocess.check_output(
+        [sys.executable, "-m", "pip", "list", "-l", editable_mode, "--format", "json", "-v"]
+    )
+    expected_packages = json.loads(pip_list_output.partition(b"\n")[0])
+    with mock.patch(
+        f"{MODULE_TO_TEST}.subprocess.check_output", side_effect=AssertionError
+    ):
+        assert packaging._get_packages(editable, sys.executable) == expected_packages
+
+
+@pytest.mark.parametrize("enable_user_site", [True, False])
+def test_find_egg_link_in_user_site(tmpdir, enable_user_site):
+    tmpdir.join("user-lib.egg-link").write_text("/path/to/user-lib\n.", encoding="utf-8")
+    expected_egg_link = str(tmpdir.join("user-lib.egg-link")) if enable_user_site else None
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(
+            mock.patch(f"{MODULE_TO_TEST}.site.ENABLE_USER_SITE", enable_user_site)
+        )
+        stack.enter_context(
+            mock.patch(
+                f"{MODULE_TO_TEST}.site.getusersitepackages", return_value=str(tmpdir)
+            )
+        )
+        assert packaging._find_egg_link("user-lib") == expected_egg_link
+        assert packaging._find_egg_link("user_lib") == expected_egg_link
+
+
+def test_get_packages_is_cached(clear_packages_cache):
+    with mock.patch(f"{MODULE_TO_TEST}.subprocess.check_output") as mock_check_output:
+        mock_check_output.return_value = '[{"name": "a", "version": "1.0"}]'.encode()
+        packaging._get_packages(False, "/path/to/python")
+        packaging._get_packages(False, "/path/to/python")
+        mock_check_output.assert_called_once()
+
+        packaging._get_packages(True, "/path/to/python")
+        packaging._get_packages(False, "/path/to/other/python")
+        assert mock_check_output.call_count == 3
+
+
+def test_get_packages_is_invalidated_when_packages_change(clear_packages_cache):
+    with tempfile.TemporaryDirectory() as tempdir:
+        _create_venv(tempdir)
+        python = f"{tempdir}/bin/python"
+        assert "cloudpickle" not in packaging.get_non_editable_requirements(python)
+
+        subprocess.check_call([python, "-m", "pip", "install", "cloudpickle"])
+        assert "cloudpickle" in packaging.get_non_editable_requirements(python)
+
+        subprocess.check_call([python, "-m", "pip", "uninstall", "-y", "cloudpickle"])
+        assert "cloudpickle" not in packaging.get_non_editable_requirements(python)
+
+
+def test_get_default_fs():
+    packaging.get_default_fs.cache_clear()
+    try:
+        with mock.patch(
+            f"{MODULE_TO_TEST}.subprocess.check_output"
+        ) as mock_check_output, mock.patch.dict("os.environ"):
+            os.environ.pop("HADOOP_FS_DEFAULTFS", None)
+            mock_check_output.return_value = b"hdfs://root\n"
+            assert packaging.get_default_fs() == "hdfs://root"
+            assert packaging.get_default_fs() == "hdfs://root"
+            mock_check_output.assert_called_once()
+    finally:
+        packaging.get_default_fs.cache_clear()
+
+
+def test_get_default_fs_from_env():
+    packaging.get_default_fs.cache_clear()
+    try:
+        with mock.patch(
+            f"{MODULE_TO_TEST}.subprocess.check_output"
+        ) as mock_check_output, mock.patch.dict("os.environ"):
+            os.environ["HADOOP_FS_DEFAULTFS"] = "viewfs://root"
+            assert packaging.get_default_fs() == "viewfs://root"
+            mock_check_output.assert_not_called()
+    finally:
+        packaging.get_default_fs.cache_clear()
+
+
 test_data = [
     ("/path/to/myenv.pex", "./myenv.pex", "myenv.pex"),
     ("/path/to/myenv.pex.zip", f"{LARGE_PEX_CMD}", UNPACKED_ENV_NAME),
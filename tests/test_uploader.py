@@ -2,9 +2,13 @@ import re
 import subprocess
 import sys
 import contextlib
+import http.server
+import io
 import json
 import os
 import tempfile
+import threading
+import urllib.error
 from unittest import mock
 
 import pytest
@@ -21,17 +25,23 @@ MYARCHIVE_METADATA = "myarchive.json"
 
 
 def test_update_no_archive():
-    map_is_exist = {MYARCHIVE_FILENAME: False}
     mock_fs = mock.MagicMock()
-    mock_fs.exists = lambda arg: map_is_exist[arg]
+    mock_fs.ls.return_value = []
+    assert not uploader._is_archive_up_to_date(MYARCHIVE_FILENAME, [], mock_fs)
+
+
+def test_update_no_dir():
+    mock_fs = mock.MagicMock()
+    mock_fs.ls.side_effect = FileNotFoundError
     assert not uploader._is_archive_up_to_date(MYARCHIVE_FILENAME, [], mock_fs)
 
 
 def test_update_no_metadata():
-    map_is_exist = {MYARCHIVE_FILENAME: True, MYARCHIVE_METADATA: False}
     mock_fs = mock.MagicMock()
-    mock_fs.exists = lambda arg: map_is_exist[arg]
+    mock_fs.ls.return_value = [{"name": MYARCHIVE_FILENAME}]
     assert not uploader._is_archive_up_to_date(MYARCHIVE_FILENAME, [], mock_fs)
+    mock_fs.exists.assert_not_called()
+    mock_fs.open.assert_not_called()
 
 
 @pytest.mark.parametrize(
@@ -119,10 +129,11 @@ def test_update_version_comparaison(
 ):
     platform_mock.return_value = build_platform_mock()
     sys_mock.version_info = build_python_version_mock()
-    map_is_exist = {MYARCHIVE_FILENAME: True, MYARCHIVE_METADATA: True}
-
     mock_fs = mock.MagicMock()
-    mock_fs.exists = lambda arg: map_is_exist[arg]
+    mock_fs.ls.return_value = [
+        {"name": MYARCHIVE_FILENAME},
+        {"name": MYARCHIVE_METADATA},
+    ]
 
     with mock.patch.object(
         mock_fs, "open", mock.mock_open(read_data=json.dumps(metadata_packages))
@@ -135,6 +146,36 @@ def test_update_version_comparaison(
         )
 
 
+def test_dump_metadata_removed_concurrently():
+    mock_fs = mock.Mock()
+    mock_fs.exists.return_value = True
+    mock_fs.rm.side_effect = FileNotFoundError
+    uploader._dump_archive_metadata(MYARCHIVE_FILENAME, ["a==1.0"], mock_fs)
+    mock_fs.put.assert_called_once_with(mock.ANY, MYARCHIVE_METADATA)
+
+
+def test_update_reads_metadata_once_until_modified(tmpdir):
+    uploader._ARCHIVE_UP_TO_DATE_CACHE.clear()
+    package_path = str(tmpdir.join(MYARCHIVE_FILENAME))
+    tmpdir.join(MYARCHIVE_FILENAME).write_binary(b"")
+    local_fs, _ = filesystem.resolve_filesystem_and_path(package_path)
+    uploader._dump_archive_metadata(package_path, ["a==1.0"], local_fs)
+
+    with mock.patch.object(local_fs, "open", wraps=local_fs.open) as mock_open:
+        assert uploader._is_archive_up_to_date(package_path, ["a==1.0"], local_fs)
+        assert uploader._is_archive_up_to_date(package_path, ["a==1.0"], local_fs)
+        assert mock_open.call_count == 1
+
+        assert not uploader._is_archive_up_to_date(package_path, ["b==1.0"], local_fs)
+        assert mock_open.call_count == 2
+        assert len(uploader._ARCHIVE_UP_TO_DATE_CACHE) == 1
+
+        metadata_path = tmpdir.join(MYARCHIVE_METADATA)
+        os.utime(metadata_path, (0, 0))
+        assert uploader._is_archive_up_to_date(package_path, ["a==1.0"], local_fs)
+        assert mock_open.call_count == 3
+
+
 def Any(cls):
     class Any(cls):
         def __eq__(self, other):
@@ -177,9 +218,10 @@ def pack_spec_in_pex_mock(
     return output
 
 
+@pytest.mark.parametrize("use_orjson", [True, False])
 @mock.patch(f"{MODULE_TO_TEST}.platform.platform")
 @mock.patch(f"{MODULE_TO_TEST}.sys")
-def test_dump_metadata(sys_mock, platform_mock):
+def test_dump_metadata(sys_mock, platform_mock, use_orjson):
     platform_mock.return_value = build_platform_mock()
     sys_mock.version_info = build_python_version_mock()
     mock_fs = mock.Mock()
@@ -189,14 +231,17 @@ def test_dump_metadata(sys_mock, platform_mock):
     def put_mock(src, dest):
         with open(src, "r") as f:
             assert f.read() == (
-                '{\n    "package_installed": [\n        "a==1.0",\n        "b==2.0"\n    ],'
-                + '\n    "platform": "fake_platform",\n    "python_version": "3.9.10"\n}'
+                '{"package_installed":["a==1.0","b==2.0"],'
+                + '"platform":"fake_platform","python_version":"3.9.10"}'
             )
 
     mock_fs.put.side_effect = put_mock
 
     packages = ["a==1.0", "b==2.0"]
-    uploader._dump_archive_metadata(MYARCHIVE_FILENAME, packages, mock_fs)
+    with contextlib.ExitStack() as stack:
+        if not use_orjson:
+            stack.enter_context(mock.patch("cluster_pack.packaging.orjson", None))
+        uploader._dump_archive_metadata(MYARCHIVE_FILENAME, packages, mock_fs)
     # Check previous file has been deleted
     mock_fs.rm.assert_called_once_with(MYARCHIVE_METADATA)
     mock_fs.put.assert_called_once()
@@ -266,7 +311,7 @@ def test_upload_env_should_throw_error_if_wrong_extension():
         cluster_pack.upload_env("myarchive.tar.gz", packer=cluster_pack.PEX_PACKER)
 
 
-def test_upload_zip():
+def test_upload_zip(tmpdir):
     home_fs_path = "/user/j.doe"
     with mock.patch(
         f"{MODULE_TO_TEST}.filesystem.resolve_filesystem_and_path"
@@ -277,23 +322,60 @@ def test_upload_zip():
             with mock.patch(f"{MODULE_TO_TEST}.tempfile") as mock_tempfile:
                 mock_fs.exists.return_value = False
                 mock_tempfile.TemporaryDirectory.return_value.__enter__.return_value = (
-                    "/tmp"
+                    str(tmpdir)
                 )
+                response = io.BytesIO(b"pex content")
+                response.headers = {"Content-Length": "11"}
+                mock_request.urlopen.return_value.__enter__.return_value = response
 
                 result = cluster_pack.upload_zip(
                     "http://myserver/mypex.pex", f"{home_fs_path}/blah.pex"
                 )
 
-                mock_request.urlretrieve.assert_called_once_with(
-                    "http://myserver/mypex.pex", "/tmp/mypex.pex"
+                mock_request.urlopen.assert_called_once_with(
+                    "http://myserver/mypex.pex"
                 )
+                assert tmpdir.join("mypex.pex").read_binary() == b"pex content"
                 mock_fs.put.assert_any_call(
-                    "/tmp/mypex.pex", f"{home_fs_path}/blah.pex"
+                    f"{tmpdir}/mypex.pex", f"{home_fs_path}/blah.pex"
                 )
 
                 assert "/user/j.doe/blah.pex" == result
 
 
+@contextlib.contextmanager
+def _serve(content_length, body):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(content_length))
+            self.end_headers()
+            self.wfile.write(body)
+            self.close_connection = True
+
+    server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/mypex.pex"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_download(tmpdir):
+    local_path = str(tmpdir.join("mypex.pex"))
+    with _serve(11, b"pex content") as url:
+        uploader._download(url, local_path)
+    assert tmpdir.join("mypex.pex").read_binary() == b"pex content"
+
+
+def test_download_content_too_short(tmpdir):
+    with _serve(1000, b"pex conten") as url:
+        with pytest.raises(urllib.error.ContentTooShortError):
+            uploader._download(url, str(tmpdir.join("mypex.pex")))
+
+
 def test_upload_env_in_a_pex():
     home_path = "/home/j.doe"
     home_fs_path = "/user/j.doe"